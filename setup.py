@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup
 
 long_desc = """
 A PyTorch implementation of Scalable Training of Artificial Neural Networks with Adaptive Sparse Connectivity inspired by Network Science by Mocanu et al. (https://arxiv.org/abs/1707.04780)
@@ -14,6 +14,7 @@ setup(
     author='Michael Klear',
     author_email='michael.r.klear@gmail.com',
     url='https://github.com/AlliedToasters/synapses/archive/v0.0.13.tar.gz',
-    install_requires=['torch'],
+    install_requires=['torch>=2.0', 'numpy'],
+    extras_require={'numba': ['numba']},
     packages=['synapses']
 )
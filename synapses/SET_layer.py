@@ -3,6 +3,84 @@ from torch import nn
 import torch.nn.functional as F
 
 import math
+import warnings
+import numpy as np
+
+from . import evolution
+
+
+def _set_forward(x, weight, crow, col, perm, bias, outdim, indim):
+    """Sparse forward pass: z = x @ W.T + bias with W stored as CSR."""
+    w = weight.index_select(0, perm)
+    W = torch.sparse_csr_tensor(crow, col, w, (outdim, indim),
+                                dtype=w.dtype, device=w.device)
+    if bias is None:
+        return torch.mm(W, x.t()).t()
+    #bias rides along as the addmm accumulator
+    z0 = bias.unsqueeze(1).expand(outdim, x.shape[0])
+    return torch.addmm(z0, W, x.t()).t()
+
+def _segment_forward(x, weight, col, perm, lengths, bias):
+    """Dense forward pass: per-connection products in CSR order,
+    summed per output node with a segment reduction."""
+    k = x.t().index_select(0, col) * weight.index_select(0, perm).unsqueeze(1)
+    z = torch.segment_reduce(k, 'sum', lengths=lengths).t()
+    if bias is not None:
+        z = z + bias
+    return z
+
+def _block_forward(x, weight, in_idx, out_idx, bias, indim, outdim, block_size):
+    """Block-sparse forward pass: the weight vector is a stack of dense
+    (block_size x block_size) tiles, multiplied with a batched matmul
+    (tensor-core friendly on GPU)."""
+    bs = block_size
+    B = x.shape[0]
+    n_in = indim // bs
+    n_out = outdim // bs
+    tiles = weight.view(-1, bs, bs)
+    #the first parameter of each tile sits at the tile's corner
+    block_in = torch.div(in_idx[::bs * bs], bs, rounding_mode='floor')
+    block_out = torch.div(out_idx[::bs * bs], bs, rounding_mode='floor')
+    xb = x.reshape(B, n_in, bs).index_select(1, block_in).permute(1, 2, 0)
+    yb = torch.bmm(tiles, xb).permute(2, 0, 1)
+    if bias is None:
+        z = yb.new_zeros([B, n_out, bs])
+    else:
+        #start the accumulation from the bias instead of zeros
+        z = bias.reshape(1, n_out, bs).expand(B, n_out, bs).contiguous()
+    z = z.index_add_(1, block_out, yb)
+    return z.reshape(B, outdim)
+
+def _sample_keys(rng, n, n_slots, existing):
+    """
+    Draws n distinct keys in [0, n_slots) not in existing
+    (a sorted int64 array). Memory is O(n + len(existing)).
+    """
+    n_free = n_slots - len(existing)
+    if n <= n_free // 50:
+        #choice() without replacement is O(n) in this regime: draw
+        #ranks among the free slots, then shift each past taken keys
+        ranks = rng.choice(n_free, size=n, replace=False)
+        offsets = existing - np.arange(len(existing))
+        return ranks + np.searchsorted(offsets, ranks, side='right')
+
+    #here choice() would permute all n_slots; oversample and reject
+    keys = np.zeros(0, dtype=np.int64)
+    while len(keys) < n:
+        need = n - len(keys)
+        free = n_free - len(keys)
+        n_draw = min(need * n_slots // free + 64, 4 * n + 64)
+        cand = rng.integers(n_slots, size=n_draw)
+        cand = cand[~np.isin(cand, existing)]
+        keys = np.union1d(keys, cand)
+    #union1d sorts; shuffle before truncating
+    return rng.permutation(keys)[:n]
+
+#dtypes with CSR matmul kernels on every device
+_CSR_DTYPES = (torch.float32, torch.float64)
+
+#below this sparsity a dense GEMM beats any sparse kernel
+_DENSE_SPARSITY = .5
 
 class SETLayer(nn.Module):
     r"""Impliments an evolutionary sparse layer.
@@ -15,7 +93,8 @@ class SETLayer(nn.Module):
                        (proportional to number of parameters in layer)
             Default: 11
         sparsity (float): Manually set sparsity of weight matrix
-                          (alternate to epsilon)
+                          (alternate to epsilon). Layers with sparsity
+                          below .5 use a dense weight matrix (see `dense`).
             Default: None
             
         zeta (float): proportion of connections to reset on 
@@ -25,18 +104,47 @@ class SETLayer(nn.Module):
         bias: If set to False, the layer will not learn an additive bias.
             Default: ``True``
 
+        block_size (int): If set, connections are grown, evolved and
+                          stored as whole dense (block_size x block_size)
+                          tiles, and the forward pass on CUDA uses a
+                          block-sparse batched matmul. in_features and
+                          out_features must be multiples of block_size.
+            Default: None
+
+        use_numba (bool): If set, connection evolution on CPU runs as a
+                          single numba-compiled routine (requires numba;
+                          the first evolution step blocks while it
+                          compiles).
+            Default: ``False``
+
     Attributes:
         sparsity: the sparsity of the weight matrix (directly set or
             determined by the Erdös–Rényi random graph propability distribution)
         n_params: the number of parameters in the sparse weight matrix
-            `(out_features x in_features x (1-sparsity))`
-        weight: weight parameters (vector of shape (n_params,))
+            `(out_features x in_features x (1-sparsity))`, rounded to
+            whole tiles if block_size is set
+        weight: weight parameters (vector of shape (n_params,), or
+            `(out_features, in_features)` if dense)
+        dense: True if the layer is dense enough to run as a plain
+            linear layer. Dense layers have no connections to evolve;
+            their sparsity is 0 and connections is None.
         indim: set by `in_features`
         outdim: set by `out_features`
         
         
-        connections: A torch tensor of shape (n_params, 2). Indicates
-        the input node and output node for each weight parameter.
+        in_idx, out_idx: int64 buffers of shape (n_params,). Input node
+        and output node for each weight parameter.
+
+        edge_keys: int64 buffer of shape (n_params,) encoding each
+        connection as `in_idx * out_features + out_idx` (derived; not
+        saved in state_dict).
+
+        connections: A torch tensor of shape (n_params, 2) stacking
+        in_idx and out_idx (read-only convenience view, None if dense).
+
+        crow_indices, col_indices, perm, row_lengths: CSR structure of
+        the weight matrix (rows are output nodes). perm maps CSR order
+        into the parameter vector.
         
         bias: the learnable bias of the module of shape `(out_features)`
 
@@ -69,111 +177,197 @@ class SETLayer(nn.Module):
                  epsilon=11,
                  sparsity=None,
                  zeta=.3,
-                 bias=True
+                 bias=True,
+                 block_size=None,
+                 use_numba=False
                 ):
         super(SETLayer, self).__init__()
         self.indim = in_features
         self.outdim = out_features
         self.epsilon = epsilon
         self.zeta = zeta
+        if block_size is not None:
+            if block_size <= 0:
+                raise ValueError(
+                    'block_size must be positive, got {}'.format(block_size))
+            if self.indim % block_size or self.outdim % block_size:
+                raise ValueError(
+                    'in_features and out_features must be multiples of '
+                    'block_size ({}), got {} and {}'.format(
+                        block_size, self.indim, self.outdim))
+        self.block_size = block_size
+        if use_numba and not evolution.HAS_NUMBA:
+            raise ImportError('use_numba=True requires numba to be installed')
+        self.use_numba = use_numba
         if sparsity is not None:
             self.sparsity = sparsity
         else:
             #Erdös–Rényi random graph probability
             density = (epsilon * (self.indim + self.outdim))/(self.indim * self.outdim)
-            sparsity = 1 - density
-            if sparsity > 1:
-                sparsity = .9
-            self.sparsity = sparsity
-        self.n_params = int(self.indim * self.outdim * (1 - self.sparsity))
+            self.sparsity = max(1 - density, 0.)
+        self.dense = self.sparsity < _DENSE_SPARSITY
+        if self.dense:
+            warnings.warn(
+                'SETLayer({}, {}) has sparsity {:.2f}; using a dense weight '
+                'matrix without connection evolution.'.format(
+                    self.indim, self.outdim, self.sparsity))
+            self.sparsity = 0.
+            self.n_params = self.indim * self.outdim
+        else:
+            self.n_params = int(self.indim * self.outdim * (1 - self.sparsity))
+            if self.block_size is not None:
+                tile = self.block_size ** 2
+                self.n_params = max(1, round(self.n_params / tile)) * tile
         self.marked_indices = None
         
-        self.connections = None
-        self.grow_connections()
-        self.generate_zmap()
-        
-        self.weight = nn.Parameter(torch.Tensor(self.n_params))
+        if self.dense:
+            self.weight = nn.Parameter(torch.Tensor(self.outdim, self.indim))
+        else:
+            self.weight = nn.Parameter(torch.Tensor(self.n_params))
         if bias:
             self.bias = nn.Parameter(torch.Tensor(out_features))
         else:
             self.register_parameter('bias', None)
         self.reset_parameters()
+
+        #index buffers follow the module across .to()/.cuda()
+        self.register_buffer('in_idx', None)
+        self.register_buffer('out_idx', None)
+        #derived from in_idx/out_idx, so not saved in state_dict
+        for name in ['edge_keys', 'crow_indices', 'col_indices', 'perm',
+                     'row_lengths']:
+            self.register_buffer(name, None, persistent=False)
+        if not self.dense:
+            self.grow_connections()
         
         #if using an optimizer with buffers, please assign it to this var
         #for housekeeping.
         self.optimizer = None
             
     def grow_connections(self, indices=None):
-        """Randomly assigns connections."""
+        """
+        Randomly assigns connections.
+        With block_size set, whole tiles containing indices are regrown.
+        """
         if indices is None:
             n_connections = self.n_params
+            keep = None
         else:
+            indices = torch.as_tensor(indices, device=self.in_idx.device)
+            if self.block_size is not None:
+                tile = self.block_size ** 2
+                indices = self._tile_params(
+                    torch.unique(torch.div(indices, tile, rounding_mode='floor')))
             n_connections = len(indices)
-        connections = self.generate_connections(n_connections)
+            #slots being reassigned don't count as taken
+            keep = torch.ones(self.n_params, dtype=torch.bool, device=self.in_idx.device)
+            keep[indices] = False
+        in_idx, out_idx = self.generate_connections(n_connections, keep)
+        edge_keys = in_idx * self.outdim + out_idx
         if indices is None:
-            self.connections = connections
+            self.in_idx = in_idx
+            self.out_idx = out_idx
+            self.edge_keys = edge_keys
         else:
-            self.connections[indices] = connections
+            self.in_idx[indices] = in_idx
+            self.out_idx[indices] = out_idx
+            self.edge_keys[indices] = edge_keys
+        self._build_csr()
+
+    @property
+    def connections(self):
+        """
+        (n_params, 2) view of (input node, output node) per parameter.
+        None for dense layers.
+        """
+        if self.dense:
+            return None
+        return torch.stack([self.in_idx, self.out_idx], dim=1)
             
-    def generate_connections(self, n_connections):
+    def generate_connections(self, n_connections, keep=None):
         """
         Generates a set of connections randomly,
-        avoids existing connections.
+        avoids existing connections (only those selected by
+        boolean mask keep, if passed).
+        Returns (input node, output node) index tensors.
         number of connections is equal to the number of 
         connections needed to get len(self.prms) == n_params
         """
-        if self.connections is not None:
-            t = self.connections
-            t = set([(int(x[0]), int(x[1])) for x in t])
-        else:
-            t = set()
-        
-        #generate extras in case of duplicates
-        iidx = torch.randint(self.indim, size=(int(n_connections*1.5),)).reshape(-1, 1)
-        oidx = torch.randint(self.outdim, size=(int(n_connections*1.5),)).reshape(-1, 1)
-        t_ = torch.cat([iidx, oidx], dim=1).int()
-        t_ = set([(int(x[0]), int(x[1])) for x in t_])
-        new_locs = [torch.tensor([tup[0], tup[1]]).int().reshape(1, -1) for tup in t_ if tup not in t]
-        new_locs = torch.cat(new_locs, dim=0)
-        
-        #if not enough unique connections, try again:
-        if len(new_locs) < n_connections:
-            return self.generate_connections(n_connections)
+        if self.edge_keys is not None:
+            existing = self.edge_keys
+            if keep is not None:
+                existing = existing[keep]
+            existing = np.sort(existing.cpu().numpy())
         else:
-            return new_locs[:n_connections]
+            existing = np.zeros(0, dtype=np.int64)
+
+        #seeded from torch so torch.manual_seed stays reproducible
+        rng = np.random.default_rng(int(torch.randint(2**62, ())))
+        if self.block_size is not None:
+            return self._generate_tiles(rng, n_connections, existing)
+        keys = _sample_keys(rng, n_connections, self.indim * self.outdim, existing)
+
+        new = torch.from_numpy(keys.astype(np.int64, copy=False)).to(self.weight.device)
+        return torch.div(new, self.outdim, rounding_mode='floor'), new % self.outdim
         
+    def _generate_tiles(self, rng, n_connections, existing):
+        """
+        Block-structured generate_connections: draws whole tiles
+        avoiding the tiles of existing edge keys. Parameters are laid
+        out tile by tile, row-major within each tile.
+        """
+        bs = self.block_size
+        n_in = self.indim // bs
+        n_tiles = n_connections // (bs * bs)
+        taken = np.unique((existing % self.outdim) // bs * n_in
+                          + (existing // self.outdim) // bs)
+        tiles = _sample_keys(rng, n_tiles, n_in * (self.outdim // bs), taken)
+        tiles = torch.from_numpy(tiles.astype(np.int64, copy=False)).to(self.weight.device)
+
+        r = torch.arange(bs, device=tiles.device).repeat_interleave(bs)
+        c = torch.arange(bs, device=tiles.device).repeat(bs)
+        out_idx = (torch.div(tiles, n_in, rounding_mode='floor') * bs).unsqueeze(1) + r
+        in_idx = (tiles % n_in * bs).unsqueeze(1) + c
+        return in_idx.reshape(-1), out_idx.reshape(-1)
+
+    def _tile_params(self, tiles):
+        """Parameter indices of the given tiles."""
+        tile = self.block_size ** 2
+        offsets = torch.arange(tile, device=tiles.device)
+        return (tiles.unsqueeze(1) * tile + offsets).reshape(-1)
+
     def mark_connections(self):
         """
         Finds parameters closest to zero in proportion
         self.zeta.
+        With block_size set, marks the proportion zeta of tiles
+        with the smallest mean magnitude instead.
         Returns a list of indices marked for death.
         """
+        if self.block_size is not None:
+            score = self.weight.data.abs().view(-1, self.block_size ** 2).mean(1)
+            k = int(score.numel() * self.zeta)
+            tiles = torch.topk(score, k, largest=False).indices
+            return self._tile_params(tiles)
         tens = self.weight.data
+        pos = tens > 0
+        neg = tens < 0
+        kill = torch.zeros_like(pos)
 
-        pos = (tens > 0).int()
-        numpos = int(torch.sum(pos))
-
-        neg = (tens < 0).int()
-        numneg = int(torch.sum(neg))
-
-        neg_tokill = int(numneg * self.zeta)
-        neg_k = neg_tokill + numpos
+        #kill values at or below the zeta-quantile of each sign's magnitude
+        pos_vals = tens[pos]
+        pos_tokill = int(pos_vals.numel() * self.zeta)
+        if pos_tokill > 0:
+            t_pos = torch.kthvalue(pos_vals, pos_tokill).values
+            kill |= pos & (tens <= t_pos)
 
-        pos_tokill = int(numpos * self.zeta)
-        pos_k = pos_tokill + numneg
+        neg_vals = -tens[neg]
+        neg_tokill = int(neg_vals.numel() * self.zeta)
+        if neg_tokill > 0:
+            t_neg = torch.kthvalue(neg_vals, neg_tokill).values
+            kill |= neg & (tens >= -t_neg)
 
-        vals, inds = torch.topk(tens, k=neg_k, largest=True)
-        kill_neg = torch.zeros_like(tens).int()
-        kill_neg[inds] = 1
-        to_kill_neg = neg * kill_neg
-
-        vals, inds = torch.topk(tens, k=pos_k, largest=False)
-        kill_pos = torch.zeros_like(tens).int()
-        kill_pos[inds] = 1
-        to_kill_pos = pos * kill_pos
-
-        all_to_kill = to_kill_neg + to_kill_pos
-        return torch.nonzero(all_to_kill).reshape(-1)
+        return kill.nonzero(as_tuple=True)[0]
     
     def kill_parameters(self, indices):
         """Sets specified parameters to zero."""
@@ -183,6 +377,8 @@ class SETLayer(nn.Module):
         
     def zero_connections(self):
         """Sets small parameters to zero without changing connections."""
+        if self.dense:
+            return
         indices = self.mark_connections()
         self.kill_parameters(indices)
         self.marked_indices = indices
@@ -194,30 +390,52 @@ class SETLayer(nn.Module):
         Otherwise, connections are randomly initialized
         by sampling from same init distribution as t=0
         """
-        if self.marked_indices is None:
+        if self.dense:
+            return
+        numba_step = self.marked_indices is None and self._numba_evolution()
+        if numba_step:
+            #mark and regrow in one compiled pass; arrays share memory
+            seed = int(torch.randint(2**62, ()))
+            indices, in_idx, out_idx = evolution.evolve(
+                self.weight.data.numpy(), self.in_idx.numpy(),
+                self.out_idx.numpy(), self.zeta, self.indim, self.outdim,
+                evolution.seed_state(seed))
+            indices = torch.from_numpy(indices)
+        elif self.marked_indices is None:
             indices = self.mark_connections()
         else:
             indices = self.marked_indices
         if init:
             stdv = math.sqrt(2/self.indim)
-            new_values = torch.randn((len(indices))) * stdv
+            new_values = torch.empty_like(indices, dtype=self.weight.dtype)
+            self.weight.data.index_copy_(0, indices, new_values.normal_(0, stdv))
         else:
-            new_values = torch.zeros_like(indices)
-        self.weight.data[indices] = new_values
+            self.weight.data.index_fill_(0, indices, 0.)
         if self.optimizer is not None:
             #Here we erase optimizer buffers.
             self._clear_buffers(indices)
-        self.grow_connections(indices)
-        self.generate_zmap()
+        if numba_step:
+            self.in_idx = torch.from_numpy(in_idx)
+            self.out_idx = torch.from_numpy(out_idx)
+            self.edge_keys = self.in_idx * self.outdim + self.out_idx
+            self._build_csr()
+        else:
+            self.grow_connections(indices)
         
+    def _numba_evolution(self):
+        """True if the numba-compiled CPU evolution step can be used."""
+        return self.use_numba and self.block_size is None \
+            and self.weight.device.type == 'cpu' \
+            and self.weight.dtype in (torch.float32, torch.float64)
+
     def _clear_buffers(self, indices):
         """
         Resets buffers from memory according to passed indices.
         When connections are reset, parameters should be treated
         as freshly initialized.
         """
-        zeros = torch.zeros_like(indices).float()
-        ones = torch.ones_like(indices).float()
+        zeros = torch.zeros_like(indices, dtype=self.weight.dtype)
+        ones = torch.ones_like(indices, dtype=self.weight.dtype)
         buffers = list(self.optimizer.state[self.weight])
         for buffer in buffers:
             if buffer == 'momentum_buffer':
@@ -241,33 +459,49 @@ class SETLayer(nn.Module):
             #elif buffer == ''
                 
         
-    def generate_zmap(self):
-        """Generates an indexing map for forward pass"""
-        z_map = []
-        longest = 0
-        for i in range(self.outdim):
-            prms = self.connections[:, 1] == i
-            indcs = torch.nonzero(prms).reshape(-1).int()
-            longest = max(longest, len(indcs))
-            z_map.append(indcs)
-
-        z_inds = (torch.ones((self.outdim, longest)) * self.n_params).int()
-        for i, inds in enumerate(z_map):
-            z_inds[i, :len(inds)] = inds
-
-        self.zmap = z_inds.long()
+    @torch.no_grad()
+    def _build_csr(self):
+        """
+        Generates the CSR indexing structure for forward pass.
+        Connections are sorted by output node; perm maps the
+        sorted order back to the parameter vector.
+        Rebuilt eagerly wherever connections change, never in forward.
+        """
+        perm = torch.argsort(self.out_idx, stable=True)
+        counts = torch.bincount(self.out_idx, minlength=self.outdim)
+        crow = torch.zeros(self.outdim + 1, dtype=torch.long, device=counts.device)
+        crow[1:] = counts.cumsum(0)
+        col = self.in_idx[perm]
+
+        self.crow_indices = crow
+        self.col_indices = col
+        self.perm = perm
+        self.row_lengths = counts
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        super(SETLayer, self)._load_from_state_dict(*args, **kwargs)
+        if self.dense:
+            return
+        #loaded connections may differ; rebuild derived buffers
+        self.edge_keys = self.in_idx * self.outdim + self.out_idx
+        self._build_csr()
 
     def reset_parameters(self):
         stdv = math.sqrt(2/self.indim)
-        self.weight.data = torch.randn(self.n_params) * stdv
+        self.weight.data.normal_(0, stdv)
         if self.bias is not None:
-            self.bias.data = torch.randn(self.outdim) * stdv
+            self.bias.data.normal_(0, stdv)
 
     def forward(self, x):
-        inds = self.connections[:, 0].long()
-        k = x[:, inds]
-        k = k * self.weight
-        k = torch.cat([k, torch.zeros(k.shape[0], 1)], 1)
-        zmat = k[:, self.zmap]
-        z = zmat.sum(dim=2)
-        return z + self.bias
\ No newline at end of file
+        if self.dense:
+            return F.linear(x, self.weight, self.bias)
+        if self.block_size is not None and x.is_cuda:
+            return _block_forward(x, self.weight, self.in_idx, self.out_idx,
+                                  self.bias, self.indim, self.outdim,
+                                  self.block_size)
+        if not x.is_cuda and x.dtype not in _CSR_DTYPES:
+            #no CPU sparse kernel for this dtype (e.g. half)
+            return _segment_forward(x, self.weight, self.col_indices, self.perm,
+                                    self.row_lengths, self.bias)
+        return _set_forward(x, self.weight, self.crow_indices, self.col_indices,
+                            self.perm, self.bias, self.outdim, self.indim)
@@ -0,0 +1,107 @@
+"""
+Numba-compiled evolution step for SETLayer on CPU.
+
+Optional: requires numba, and is only used by layers created with
+use_numba=True. Other layers use the torch implementation.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        def wrap(f):
+            return f
+        return wrap
+
+
+@njit(inline='always')
+def _rotl(x, k):
+    return (x << k) | (x >> (np.uint64(64) - k))
+
+@njit(inline='always')
+def _next(state):
+    """xoroshiro128+ step; state is a uint64 array of length 2."""
+    s0 = state[0]
+    s1 = state[1]
+    result = s0 + s1
+    s1 ^= s0
+    state[0] = _rotl(s0, np.uint64(24)) ^ s1 ^ (s1 << np.uint64(16))
+    state[1] = _rotl(s1, np.uint64(37))
+    return result
+
+@njit(cache=True)
+def seed_state(seed):
+    """Expands an integer seed into a xoroshiro128+ state with splitmix64."""
+    state = np.empty(2, dtype=np.uint64)
+    x = np.uint64(seed)
+    for i in range(2):
+        x += np.uint64(0x9E3779B97F4A7C15)
+        z = x
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        state[i] = z ^ (z >> np.uint64(31))
+    return state
+
+@njit(cache=True)
+def mark(weights, zeta):
+    """
+    Finds parameters closest to zero in proportion zeta,
+    separately for positive and negative weights.
+    Returns the indices marked for death.
+    """
+    pos = weights[weights > 0]
+    neg = -weights[weights < 0]
+
+    #thresholds of -1 never match, so nothing is killed
+    t_pos = -1.
+    k = int(len(pos) * zeta)
+    if k > 0:
+        t_pos = np.partition(pos, k - 1)[k - 1]
+    t_neg = -1.
+    k = int(len(neg) * zeta)
+    if k > 0:
+        t_neg = np.partition(neg, k - 1)[k - 1]
+
+    kill = np.zeros(len(weights), dtype=np.bool_)
+    for j in range(len(weights)):
+        w = weights[j]
+        kill[j] = (w > 0 and w <= t_pos) or (w < 0 and -w <= t_neg)
+    return np.flatnonzero(kill)
+
+@njit(cache=True)
+def regrow(in_idx, out_idx, indices, indim, outdim, state):
+    """
+    Reassigns the connections at indices to random free slots,
+    avoiding the connections that are kept.
+    Returns updated copies of in_idx and out_idx.
+    """
+    keep = np.ones(len(in_idx), dtype=np.bool_)
+    keep[indices] = False
+    taken = set(in_idx[keep] * outdim + out_idx[keep])
+
+    new_in = in_idx.copy()
+    new_out = out_idx.copy()
+    n_slots = np.uint64(indim * outdim)
+    for j in indices:
+        key = np.int64(_next(state) % n_slots)
+        while key in taken:
+            key = np.int64(_next(state) % n_slots)
+        taken.add(key)
+        new_in[j] = key // outdim
+        new_out[j] = key % outdim
+    return new_in, new_out
+
+@njit(cache=True)
+def evolve(weights, in_idx, out_idx, zeta, indim, outdim, rng_state):
+    """
+    Full evolution step: marks the zeta smallest-magnitude weights
+    and draws new connections for them.
+    Returns (indices, in_idx, out_idx).
+    """
+    indices = mark(weights, zeta)
+    new_in, new_out = regrow(in_idx, out_idx, indices, indim, outdim, rng_state)
+    return indices, new_in, new_out
@@ -0,0 +1,32 @@
+import torch
+
+
+def dense_weight(layer):
+    """Scatters the parameter vector into a dense (out, in) matrix."""
+    W = torch.zeros(layer.outdim, layer.indim, dtype=layer.weight.dtype)
+    W[layer.out_idx, layer.in_idx] = layer.weight.data
+    return W
+
+
+def check_forward_backward(layer, forward, x):
+    """
+    Compares forward(x) and the resulting weight/bias gradients
+    against a dense x @ W.T + b reference.
+    """
+    g = torch.randn(x.shape[0], layer.outdim, dtype=x.dtype)
+    W = dense_weight(layer).requires_grad_()
+    expected = x @ W.t()
+    if layer.bias is not None:
+        expected = expected + layer.bias.detach()
+    (expected * g).sum().backward()
+
+    layer.zero_grad()
+    z = forward(x)
+    (z * g).sum().backward()
+
+    torch.testing.assert_close(z.detach(), expected.detach())
+    assert layer.weight.grad is not None
+    torch.testing.assert_close(layer.weight.grad,
+                               W.grad[layer.out_idx, layer.in_idx])
+    if layer.bias is not None:
+        torch.testing.assert_close(layer.bias.grad, g.sum(0))
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from synapses import SETLayer
+
+
+@pytest.mark.parametrize('as_type', [list, np.array, torch.tensor])
+def test_grow_connections_accepts_index_sequences(as_type):
+    torch.manual_seed(0)
+    layer = SETLayer(64, 48)
+    indices = list(range(0, layer.n_params, 3))
+    kept = layer.connections[[i for i in range(layer.n_params) if i % 3]]
+    layer.grow_connections(as_type(indices))
+
+    keys = layer.in_idx * layer.outdim + layer.out_idx
+    assert len(torch.unique(keys)) == layer.n_params
+    assert torch.equal(layer.connections[[i for i in range(layer.n_params) if i % 3]], kept)
+
+
+def test_edge_keys_match_indices_and_are_not_saved():
+    torch.manual_seed(0)
+    layer = SETLayer(64, 48)
+    layer.evolve_connections()
+    assert torch.equal(layer.edge_keys, layer.in_idx * layer.outdim + layer.out_idx)
+    assert 'edge_keys' not in layer.state_dict()
+
+    torch.manual_seed(1)
+    other = SETLayer(64, 48)
+    other.load_state_dict(layer.state_dict())
+    assert torch.equal(other.edge_keys, layer.edge_keys)
+    assert torch.equal(other.crow_indices, layer.crow_indices)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from synapses import SETLayer, evolution
+
+
+@pytest.mark.parametrize('dtype', [torch.float32, torch.float64])
+def test_numba_mark_matches_mark_connections(dtype):
+    pytest.importorskip('numba')
+    torch.manual_seed(0)
+    layer = SETLayer(64, 48, use_numba=True).to(dtype)
+    expected = layer.mark_connections().numpy()
+    got = evolution.mark(layer.weight.data.numpy(), layer.zeta)
+    np.testing.assert_array_equal(np.sort(got), np.sort(expected))
+
+
+def test_numba_regrow_unique_and_avoids_kept():
+    pytest.importorskip('numba')
+    torch.manual_seed(0)
+    layer = SETLayer(64, 48, use_numba=True)
+    in_idx = layer.in_idx.numpy()
+    out_idx = layer.out_idx.numpy()
+    indices = evolution.mark(layer.weight.data.numpy(), layer.zeta)
+    new_in, new_out = evolution.regrow(in_idx, out_idx, indices, layer.indim,
+                                       layer.outdim, evolution.seed_state(1))
+
+    assert new_in.min() >= 0 and new_in.max() < layer.indim
+    assert new_out.min() >= 0 and new_out.max() < layer.outdim
+    keys = new_in * layer.outdim + new_out
+    assert len(np.unique(keys)) == len(keys)
+    keep = np.ones(len(keys), dtype=bool)
+    keep[indices] = False
+    np.testing.assert_array_equal(keys[keep], (in_idx * layer.outdim + out_idx)[keep])
+
+
+def test_numba_is_opt_in():
+    assert not SETLayer(64, 48)._numba_evolution()
+    if not evolution.HAS_NUMBA:
+        with pytest.raises(ImportError):
+            SETLayer(64, 48, use_numba=True)
@@ -0,0 +1,58 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from synapses import SETLayer, SET_layer
+from synapses.SET_layer import _block_forward
+
+from .helpers import check_forward_backward
+
+
+def test_csr_forward_and_grad_match_dense():
+    torch.manual_seed(0)
+    layer = SETLayer(64, 48)
+    x = torch.randn(5, 64)
+    check_forward_backward(layer, layer, x)
+
+
+@pytest.mark.parametrize('bias', [True, False])
+@pytest.mark.parametrize('dtype', [torch.float32, torch.float64])
+def test_csr_addmm_bias_and_dtypes(bias, dtype):
+    torch.manual_seed(0)
+    layer = SETLayer(64, 48, bias=bias).to(dtype)
+    x = torch.randn(5, 64, dtype=dtype)
+    check_forward_backward(layer, layer, x)
+
+
+def test_block_forward_and_grad_match_dense():
+    torch.manual_seed(0)
+    layer = SETLayer(64, 48, block_size=8).double()
+    x = torch.randn(5, 64, dtype=torch.float64)
+    forward = lambda x: _block_forward(x, layer.weight, layer.in_idx,
+                                       layer.out_idx, layer.bias, layer.indim,
+                                       layer.outdim, layer.block_size)
+    check_forward_backward(layer, forward, x)
+
+
+def test_block_topology_is_whole_tiles():
+    torch.manual_seed(0)
+    layer = SETLayer(64, 48, block_size=8)
+    layer.evolve_connections()
+    tiles = torch.stack([layer.out_idx // 8, layer.in_idx // 8], 1).view(-1, 64, 2)
+    assert (tiles == tiles[:, :1]).all()
+    assert len(torch.unique(tiles[:, 0], dim=0)) == tiles.shape[0]
+
+
+@pytest.mark.parametrize('block_size', [0, 5])
+def test_block_size_validated(block_size):
+    with pytest.raises(ValueError):
+        SETLayer(64, 48, block_size=block_size)
+
+
+def test_segment_forward_and_grad_match_dense(monkeypatch):
+    #route CPU float64 through the segment_reduce path
+    monkeypatch.setattr(SET_layer, '_CSR_DTYPES', ())
+    torch.manual_seed(0)
+    layer = SETLayer(64, 48).double()
+    x = torch.randn(5, 64, dtype=torch.float64)
+    check_forward_backward(layer, layer, x)